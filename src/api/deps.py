@@ -0,0 +1,25 @@
+from fastapi import HTTPException, status
+import logging
+
+import firebase_admin
+from firebase_admin import firestore
+
+from src.db.firestore_client import get_db_client
+
+logger = logging.getLogger(__name__)
+
+
+def get_firestore_db() -> firestore.AsyncClient:
+    """
+    FastAPI dependency returning the shared Firestore client.
+    Responds with 503 if the Firebase Admin SDK was not initialized at startup.
+    """
+    if not firebase_admin._apps:
+        logger.warning(
+            "Firebase Admin SDK not initialized. Cannot proceed with Firebase operations."
+        )
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Firebase service not initialized.",
+        )
+    return get_db_client()
@@ -1,24 +1,23 @@
-from fastapi import APIRouter, status
+from fastapi import APIRouter, Depends, status
 from src.models.location import LocationCreate
+from src.models.fcm_token import FCMTokenInDB
 import logging
 import asyncio
-from datetime import datetime, timedelta, timezone # Import datetime utilities
+from contextlib import aclosing
+from typing import Any, Coroutine, Set
+from datetime import datetime, timezone # Import datetime utilities
 
 # Firebase Admin SDK
-import firebase_admin
-from firebase_admin import (
-    firestore,
-    # messaging, # Removed as it's now in notification_service
-)
+from firebase_admin import firestore
 from firebase_admin.exceptions import FirebaseError
-from google.cloud.firestore_v1 import FieldFilter
 
-# Geopy for distance calculation
-from geopy.distance import geodesic
+# Haversine proximity check
+from src.core.geo import make_proximity_check
 
 # Import from the new notification service
 from src.services.notification_service import send_fcm_proximity_notification
 
+from src.api.deps import get_firestore_db # Shared Firestore client (503 if Firebase is down)
 from src.crud import crud_schedule # Import the crud_schedule module
 from src.crud import crud_fcm_token # Import the new FCM token CRUD module
 from src.crud import crud_notification_history # Import notification history CRUD
@@ -26,9 +25,36 @@ from src.crud import crud_notification_history # Import notification history CRU
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+PROXIMITY_RADIUS_METERS = 100
+
+# Upper bound on concurrent proximity checks in this process
+MAX_CONCURRENT_PROXIMITY_CHECKS = 256
+_proximity_check_limiter = asyncio.Semaphore(MAX_CONCURRENT_PROXIMITY_CHECKS)
+
+# Strong references to fire-and-forget tasks; the event loop only keeps weak ones
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def _log_background_task_result(task: asyncio.Task) -> None:
+    _background_tasks.discard(task)
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        logger.error(f"Background task {task.get_name()} failed: {exc}", exc_info=exc)
+
+
+def _run_in_background(coro: Coroutine[Any, Any, Any]) -> None:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_log_background_task_result)
+
 
 @router.post("/locations/", response_model=dict, status_code=status.HTTP_200_OK)
-async def handle_location_update_and_proximity_check(location_data: LocationCreate):
+async def handle_location_update_and_proximity_check(
+    location_data: LocationCreate,
+    db: firestore.AsyncClient = Depends(get_firestore_db),
+):
     """
     Receives location data (Firebase User ID, latitude, longitude),
     checks if the user is near any of their scheduled locations,
@@ -36,71 +62,120 @@ async def handle_location_update_and_proximity_check(location_data: LocationCrea
     Returns whether the notification was sent.
     Optionally, location data can also be stored here.
     """
-    if not firebase_admin._apps:
-        logger.warning(
-            "Firebase Admin SDK not initialized. Cannot proceed with Firebase operations."
-        )
-        # Potentially raise HTTPException(status_code=503, detail="Firebase service unavailable")
-        return {
-            "notification_sent": False,
-            "detail": "Firebase service not initialized.",
-        }
-
-    # Use Async Firestore client
-    db = firestore.AsyncClient()
+    # Bound how many checks run against Firestore/FCM at once; excess requests
+    # wait here instead of piling more load onto the downstream services.
+    async with _proximity_check_limiter:
+        return await _check_proximity_and_notify(db, location_data)
+
+
+async def _check_proximity_and_notify(
+    db: firestore.AsyncClient, location_data: LocationCreate
+) -> dict:
     found_proximate_schedule = False
     notification_sent_status = False
     proximate_schedule_item = None # Store the found schedule item
     details = "No proximate schedule found or user has no token."
 
     # Placeholder for original functionality: Store the location_data if needed
-    logger.info(f"Received location for user {location_data.firebase_userid}: lat={location_data.latitude}, lon={location_data.longitude}")
+    # %-style arguments are only formatted if the record is actually emitted
+    logger.debug(
+        "Received location for user %s: lat=%s, lon=%s",
+        location_data.firebase_userid, location_data.latitude, location_data.longitude,
+    )
     # e.g., await crud.store_location(db, location_data)
 
     try:
-        # Fetch schedules using the CRUD function
-        user_schedules = await crud_schedule.get_schedules_by_user(
-            db=db, firebase_userid=location_data.firebase_userid
+        # Predicate precomputes the device-side trig once for all candidates
+        is_proximate = make_proximity_check(
+            location_data.latitude, location_data.longitude, PROXIMITY_RADIUS_METERS
         )
 
-        current_device_location = (location_data.latitude, location_data.longitude)
-
-        for schedule_item_loop in user_schedules: # Iterate over Schedule model instances
-            # schedule_item_loop is now a Schedule Pydantic model instance
-            # which has latitude and longitude attributes directly
-            
-            # Ensure schedule_item_loop has latitude and longitude
-            if schedule_item_loop.latitude is not None and schedule_item_loop.longitude is not None:
-                schedule_location = (
-                    schedule_item_loop.latitude,
-                    schedule_item_loop.longitude,
-                )
-                distance_meters = geodesic(
-                    current_device_location, schedule_location
-                ).meters
-                logger.info(f"Comparing with schedule '{schedule_item_loop.name}' (ID: {schedule_item_loop.id}). Distance: {distance_meters:.2f}m")
-
-                if distance_meters <= 100: # Using 100 meters as proximity threshold
-                    found_proximate_schedule = True
-                    proximate_schedule_item = schedule_item_loop # Save the matched schedule
-                    logger.info(
-                        f"User {location_data.firebase_userid} is within 100m of schedule '{proximate_schedule_item.name}' (ID: {proximate_schedule_item.id})."
+        # Stream only the schedules in the geohash cells around the device;
+        # aclosing() cancels the remaining reads as soon as we break out.
+        async with aclosing(
+            crud_schedule.iter_schedules_near(
+                db=db,
+                firebase_userid=location_data.firebase_userid,
+                latitude=location_data.latitude,
+                longitude=location_data.longitude,
+                radius_meters=PROXIMITY_RADIUS_METERS,
+            )
+        ) as user_schedules:
+            async for schedule_item_loop in user_schedules: # Iterate over ProximityCandidate instances
+                # schedule_item_loop only carries id, name, latitude and longitude
+
+                # Ensure schedule_item_loop has latitude and longitude
+                if schedule_item_loop.latitude is not None and schedule_item_loop.longitude is not None:
+                    within_radius = is_proximate(
+                        schedule_item_loop.latitude, schedule_item_loop.longitude
+                    )
+                    # Per-candidate trace; guarded so the hot loop does no logging work unless DEBUG is on
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(
+                            "Comparing with schedule '%s' (ID: %s). Within %sm: %s",
+                            schedule_item_loop.name, schedule_item_loop.id, PROXIMITY_RADIUS_METERS, within_radius,
+                        )
+
+                    if within_radius:
+                        found_proximate_schedule = True
+                        proximate_schedule_item = schedule_item_loop # Save the matched schedule
+                        logger.info(
+                            "User %s is within %sm of schedule '%s' (ID: %s).",
+                            location_data.firebase_userid, PROXIMITY_RADIUS_METERS, proximate_schedule_item.name, proximate_schedule_item.id,
+                        )
+                        break  # Found one, no need to check further
+                else:
+                    logger.warning(
+                        "Schedule %s for user %s has missing latitude or longitude.",
+                        schedule_item_loop.id, location_data.firebase_userid,
                     )
-                    break  # Found one, no need to check further
-            else:
-                logger.warning(
-                    f"Schedule {schedule_item_loop.id} for user {location_data.firebase_userid} has missing latitude or longitude."
-                )
 
         if found_proximate_schedule and proximate_schedule_item:
             current_time = datetime.now(timezone.utc)
             can_send_notification = True
 
-            # Check notification history for cooldown
-            history = await crud_notification_history.get_notification_history(
-                db, location_data.firebase_userid, proximate_schedule_item.id
+            # Build the history document ID once for both the read and the write below
+            history_doc_id = crud_notification_history.history_doc_id(
+                location_data.firebase_userid, proximate_schedule_item.id
             )
 
+            # Only set while the copy is younger than CACHED_FCM_TOKEN_MAX_AGE_SECONDS
+            cached_fcm_token = proximate_schedule_item.cached_fcm_token
+            if cached_fcm_token:
+                # The schedule carries a copy of the user's token, so only the history is read
+                history = await crud_notification_history.get_notification_history(
+                    db,
+                    location_data.firebase_userid,
+                    proximate_schedule_item.id,
+                    doc_id=history_doc_id,
+                )
+                fcm_token_obj = FCMTokenInDB(
+                    user_id=location_data.firebase_userid, token=cached_fcm_token
+                )
+            else:
+                # Notification history (cooldown) and FCM token are independent reads,
+                # so fetch them concurrently
+                history, fcm_token_obj = await asyncio.gather(
+                    crud_notification_history.get_notification_history(
+                        db,
+                        location_data.firebase_userid,
+                        proximate_schedule_item.id,
+                        doc_id=history_doc_id,
+                    ),
+                    crud_fcm_token.get_fcm_token_by_user_id(
+                        db=db, firebase_userid=location_data.firebase_userid
+                    ),
+                )
+                if fcm_token_obj and fcm_token_obj.token:
+                    # Copy the token onto the user's schedules for next time (or
+                    # re-stamp an expired copy). The refresh re-reads fcm_token, so the
+                    # copy never starts out older than its timestamp says.
+                    _run_in_background(
+                        crud_fcm_token.refresh_cached_fcm_token(
+                            db, location_data.firebase_userid
+                        )
+                    )
+
             if history and history.last_sent_at:
                 # Ensure last_sent_at is offset-aware for comparison with current_time
                 last_sent_at_aware = history.last_sent_at
@@ -108,26 +183,28 @@ async def handle_location_update_and_proximity_check(location_data: LocationCrea
                     last_sent_at_aware = last_sent_at_aware.replace(tzinfo=timezone.utc)
                 
                 time_since_last_sent = current_time - last_sent_at_aware
-                if time_since_last_sent < timedelta(minutes=10):
+                if time_since_last_sent < crud_notification_history.NOTIFICATION_COOLDOWN:
                     can_send_notification = False
-                    cooldown_remaining = timedelta(minutes=10) - time_since_last_sent
+                    cooldown_remaining = crud_notification_history.NOTIFICATION_COOLDOWN - time_since_last_sent
                     details = f"Notification for schedule '{proximate_schedule_item.name}' recently sent. Cooldown active for {cooldown_remaining.total_seconds() // 60:.0f} more minutes."
                     logger.info(details)
                 else:
-                    logger.info(f"Cooldown period for schedule '{proximate_schedule_item.name}' has passed. Last sent: {history.last_sent_at}")
+                    logger.info(
+                        "Cooldown period for schedule '%s' has passed. Last sent: %s",
+                        proximate_schedule_item.name, history.last_sent_at,
+                    )
             else:
-                logger.info(f"No previous notification history found for schedule '{proximate_schedule_item.name}'.")
-
-            if can_send_notification:
-                # Fetch FCM token using the CRUD function
-                fcm_token_obj = await crud_fcm_token.get_fcm_token_by_user_id(
-                    db=db, firebase_userid=location_data.firebase_userid
+                logger.info(
+                    "No previous notification history found for schedule '%s'.",
+                    proximate_schedule_item.name,
                 )
 
+            if can_send_notification:
                 if fcm_token_obj and fcm_token_obj.token:
                     user_fcm_token = fcm_token_obj.token
                     logger.info(
-                        f"Attempting to send FCM to user {location_data.firebase_userid} for schedule '{proximate_schedule_item.name}'."
+                        "Attempting to send FCM to user %s for schedule '%s'.",
+                        location_data.firebase_userid, proximate_schedule_item.name,
                     )
                     if await send_fcm_proximity_notification(
                         user_fcm_token, location_data.firebase_userid
@@ -135,13 +212,24 @@ async def handle_location_update_and_proximity_check(location_data: LocationCrea
                         notification_sent_status = True
                         details = f"Notification sent successfully for schedule '{proximate_schedule_item.name}'."
                         logger.info(details)
-                        # Update notification history
+                        # Update notification history (buffered; committed by the batched flusher)
                         await crud_notification_history.update_notification_history(
-                            db, location_data.firebase_userid, proximate_schedule_item.id, current_time
+                            db,
+                            location_data.firebase_userid,
+                            proximate_schedule_item.id,
+                            current_time,
+                            doc_id=history_doc_id,
                         )
                     else:
                         details = f"FCM token found, but failed to send notification for schedule '{proximate_schedule_item.name}'."
                         logger.error(details) # Log as error if sending failed
+                        if cached_fcm_token:
+                            # The denormalized copy may be stale; refresh it from fcm_token
+                            _run_in_background(
+                                crud_fcm_token.refresh_cached_fcm_token(
+                                    db, location_data.firebase_userid
+                                )
+                            )
                 elif fcm_token_obj:
                     details = f"FCM token document found, but token string is missing for user {location_data.firebase_userid}. Cannot send notification for '{proximate_schedule_item.name}'."
                     logger.warning(details)
@@ -150,8 +238,8 @@ async def handle_location_update_and_proximity_check(location_data: LocationCrea
                     logger.warning(details)
         else:
             details = "No proximate schedule found for the user."
-            logger.info(
-                f"No proximate schedules found for user {location_data.firebase_userid}."
+            logger.debug(
+                "No proximate schedules found for user %s.", location_data.firebase_userid
             )
 
     except FirebaseError as e:
@@ -168,32 +256,3 @@ async def handle_location_update_and_proximity_check(location_data: LocationCrea
         details = f"An unexpected error occurred: {str(e)}"
 
     return {"notification_sent": notification_sent_status, "detail": details}
-
-
-# --- Helper function to send FCM notification ---  <- This entire function will be removed
-# async def send_fcm_proximity_notification(token: str, user_id: str) -> bool:
-#     message = messaging.Message(
-#         notification=messaging.Notification(
-#             title="일정 알림",  # "Schedule Notification"
-#             body="주변에 설정된 일정이 있습니다!",  # "There is a schedule nearby!"
-#         ),
-#         token=token,
-#         # You can also send data payload if needed
-#         # data={
-#         #     "userId": user_id,
-#         #     "type": "proximity_alert"
-#         # }
-#     )
-#     try:
-#         response = await asyncio.to_thread(messaging.send, message)
-#         logger.info(f"Successfully sent FCM message to {user_id}: {response}")
-#         return True
-#     except FirebaseError as e:
-#         logger.error(f"Error sending FCM message to {user_id}: {e}", exc_info=True)
-#         # More specific error handling can be done here based on e.g. e.code
-#         # messaging.UnregisteredError, messaging.ThirdPartyAuthError etc.
-#     except Exception as e:
-#         logger.error(
-#             f"Unexpected error sending FCM message to {user_id}: {e}", exc_info=True
-#         )
-#     return False
@@ -1,38 +1,47 @@
-from fastapi import APIRouter, HTTPException, status
-from typing import List  # For older Python, use List. For 3.9+, use list
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response, status
+from firebase_admin import firestore
+from pydantic import TypeAdapter
+from typing import List, Optional  # For older Python, use List. For 3.9+, use list
 
-from firebase_admin import firestore  # For firestore.AsyncClient()
+from src.api.deps import get_firestore_db  # Shared Firestore client (503 if Firebase is down)
 from src.models.schedule import Schedule, ScheduleCreate, ScheduleUpdate
 from src.crud import crud_schedule  # Import the CRUD module
+from src.db.firestore_client import MAX_BATCH_WRITES
 import logging
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# It's good practice to initialize the client once per module if possible,
-# or pass it around, or use a dependency injection system.
-# For simplicity here, we'll create it as needed or once at module level.
-# However, since db client should be managed by lifespan ideally,
-# for now, we re-create it per call or use a simple global for this router.
-# For a robust app, use FastAPI dependencies for DB session management.
+# Schedules built by the CRUD layer are already trusted, so endpoints serialize them
+# straight to JSON with pydantic-core and return the bytes. Returning the model instead
+# makes FastAPI re-validate it against response_model, dump it to a dict and then
+# encode that dict. The output is the same aliased JSON the response_model describes.
+_SCHEDULE_LIST_ADAPTER = TypeAdapter(List[Schedule])
 
+# A bulk request fits in one WriteBatch, so it is created all-or-nothing
+MAX_BULK_SCHEDULES = MAX_BATCH_WRITES
 
-# Helper to get DB client - in a real app, use FastAPI's Depends system
-# This is a simplified approach for now.
-def get_db_client():
-    # Note: Firebase Admin SDK must be initialized (e.g., in main.py lifespan)
-    # for firestore.AsyncClient() to work correctly with ADC or provided credentials.
-    return firestore.AsyncClient()
+
+def _schedule_json_response(
+    schedule: Schedule, status_code: int = status.HTTP_200_OK
+) -> Response:
+    return Response(
+        content=schedule.model_dump_json(by_alias=True),
+        media_type="application/json",
+        status_code=status_code,
+    )
 
 
 @router.post("/", response_model=Schedule, status_code=status.HTTP_201_CREATED)
-async def create_new_schedule(schedule: ScheduleCreate):
-    db = get_db_client()
+async def create_new_schedule(
+    schedule: ScheduleCreate,
+    db: firestore.AsyncClient = Depends(get_firestore_db),
+):
     try:
         created_schedule = await crud_schedule.create_schedule(
             db=db, schedule_data=schedule
         )
-        return created_schedule
+        return _schedule_json_response(created_schedule, status.HTTP_201_CREATED)
     except Exception as e:
         logger.error(
             f"Error creating schedule for user {schedule.firebase_userid}: {e}",
@@ -44,29 +53,85 @@ async def create_new_schedule(schedule: ScheduleCreate):
         )
 
 
+@router.post(
+    "/bulk", response_model=List[Schedule], status_code=status.HTTP_201_CREATED
+)
+async def create_new_schedules_bulk(
+    schedules: List[ScheduleCreate] = Body(..., max_length=MAX_BULK_SCHEDULES),
+    db: firestore.AsyncClient = Depends(get_firestore_db),
+):
+    """
+    Creates up to MAX_BULK_SCHEDULES schedules in one atomic batch.
+    On a 500 none of them were created, so the request can be retried as is.
+    """
+    try:
+        created_schedules = await crud_schedule.create_schedules_bulk(
+            db=db, items=schedules
+        )
+    except Exception as e:
+        logger.error(f"Error creating {len(schedules)} schedules in bulk: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Could not create schedules",
+        )
+    # One pydantic-core call encodes the whole list
+    return Response(
+        content=_SCHEDULE_LIST_ADAPTER.dump_json(created_schedules, by_alias=True),
+        media_type="application/json",
+        status_code=status.HTTP_201_CREATED,
+    )
+
+
 @router.get("/user/{firebase_userid}", response_model=List[Schedule])
-async def read_schedules_by_user(firebase_userid: str):
-    db = get_db_client()
-    schedules = await crud_schedule.get_schedules_by_user(
-        db=db, firebase_userid=firebase_userid
+async def read_schedules_by_user(
+    firebase_userid: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: firestore.AsyncClient = Depends(get_firestore_db),
+):
+    """
+    Returns one page of the user's schedules.
+    When more schedules exist, the X-Next-Cursor response header holds the
+    value to pass as `cursor` to fetch the next page.
+    """
+    # Serialize each schedule as it streams in, so only its JSON bytes are kept
+    # rather than a list of models. Output matches the response_model (aliased keys).
+    rows = []
+    last_schedule_id = None
+    async for schedule in crud_schedule.iter_schedules_by_user(
+        db, firebase_userid, limit=limit, cursor=cursor
+    ):
+        rows.append(schedule.model_dump_json(by_alias=True).encode())
+        last_schedule_id = schedule.id
+
+    headers = {}
+    if len(rows) == limit and last_schedule_id is not None:
+        headers["X-Next-Cursor"] = last_schedule_id
+    return Response(
+        content=b"[" + b",".join(rows) + b"]",
+        media_type="application/json",
+        headers=headers,
     )
-    return schedules
 
 
 @router.get("/{schedule_id}", response_model=Schedule)
-async def read_schedule_by_id(schedule_id: str):
-    db = get_db_client()
+async def read_schedule_by_id(
+    schedule_id: str, db: firestore.AsyncClient = Depends(get_firestore_db)
+):
     schedule = await crud_schedule.get_schedule(db=db, schedule_id=schedule_id)
     if schedule is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Schedule not found"
         )
-    return schedule
+    return _schedule_json_response(schedule)
 
 
 @router.put("/{schedule_id}", response_model=Schedule)
-async def update_existing_schedule(schedule_id: str, schedule_update: ScheduleUpdate):
-    db = get_db_client()
+async def update_existing_schedule(
+    schedule_id: str,
+    schedule_update: ScheduleUpdate,
+    db: firestore.AsyncClient = Depends(get_firestore_db),
+):
     updated_schedule = await crud_schedule.update_schedule(
         db=db, schedule_id=schedule_id, schedule_data=schedule_update
     )
@@ -75,12 +140,13 @@ async def update_existing_schedule(schedule_id: str, schedule_update: ScheduleUp
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Schedule not found or no update performed",
         )
-    return updated_schedule
+    return _schedule_json_response(updated_schedule)
 
 
 @router.delete("/{schedule_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def remove_schedule(schedule_id: str):
-    db = get_db_client()
+async def remove_schedule(
+    schedule_id: str, db: firestore.AsyncClient = Depends(get_firestore_db)
+):
     deleted_successfully = await crud_schedule.delete_schedule(
         db=db, schedule_id=schedule_id
     )
@@ -2,6 +2,7 @@
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
+from functools import lru_cache
 import os
 
 
@@ -26,5 +27,12 @@ class Settings(BaseSettings):
     )
 
 
-# Instantiate the settings
-settings = Settings()
+# Settings are built on first use (reading .env and validating) rather than at import time.
+# Tests can call get_settings.cache_clear() to pick up a different environment.
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    # In containerized/production deploys the variable is already in the process
+    # environment, so skip locating and parsing the .env file entirely.
+    if "GOOGLE_APPLICATION_CREDENTIALS" in os.environ:
+        return Settings(_env_file=None)
+    return Settings()
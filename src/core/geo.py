@@ -0,0 +1,168 @@
+# Geographic helpers used for schedule proximity checks.
+
+import math
+from typing import Callable, List, Optional, Tuple
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Length-7 cells are about 153m tall and 153m * cos(latitude) wide. Near the equator
+# the cell containing a point plus its 8 neighbours covers a 100m radius, but above
+# roughly 50 degrees the cells get too narrow, so geohash_cells_covering widens the
+# ring east-west as needed.
+GEOHASH_PRECISION = 7
+
+# Mean Earth radius used by the spherical (haversine) distance
+EARTH_RADIUS_METERS = 6_371_008.8
+
+
+def _geohash_bounds(
+    latitude: float, longitude: float, precision: int
+) -> Tuple[str, float, float, float, float]:
+    """
+    Encodes a point and returns (geohash, lat_min, lat_max, lon_min, lon_max) of its cell.
+    """
+    lat_min, lat_max = -90.0, 90.0
+    lon_min, lon_max = -180.0, 180.0
+    chars = []
+    bits = 0
+    bit_count = 0
+    even_bit = True  # Geohash interleaves bits starting with longitude
+
+    while len(chars) < precision:
+        if even_bit:
+            mid = (lon_min + lon_max) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_min = mid
+            else:
+                bits <<= 1
+                lon_max = mid
+        else:
+            mid = (lat_min + lat_max) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_min = mid
+            else:
+                bits <<= 1
+                lat_max = mid
+        even_bit = not even_bit
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(chars), lat_min, lat_max, lon_min, lon_max
+
+
+def encode_geohash(
+    latitude: float, longitude: float, precision: int = GEOHASH_PRECISION
+) -> str:
+    return _geohash_bounds(latitude, longitude, precision)[0]
+
+
+def geohash_cells_covering(
+    latitude: float,
+    longitude: float,
+    radius_meters: float,
+    precision: int = GEOHASH_PRECISION,
+    max_cells: Optional[int] = None,
+) -> Optional[List[str]]:
+    """
+    Returns the geohash cells that together cover every point within
+    radius_meters of the given point: the cell containing it first, then
+    enough rings of neighbours that none of the circle falls outside them.
+    Querying neighbours too avoids missing schedules that sit just across a
+    cell boundary, where a plain prefix match would fail.
+    Returns None if more than max_cells cells would be needed (very close to
+    the poles, where cells become very narrow).
+    """
+    center, lat_min, lat_max, lon_min, lon_max = _geohash_bounds(
+        latitude, longitude, precision
+    )
+    lat_step = lat_max - lat_min
+    lon_step = lon_max - lon_min
+    center_lat = (lat_min + lat_max) / 2
+    center_lon = (lon_min + lon_max) / 2
+
+    # The point lies inside the centre cell, so k rings of cells reach at least
+    # k cell widths past it in every direction. Radius in degrees of arc with
+    # the same 1% slack as make_proximity_check.
+    radius_degrees = math.degrees(radius_meters / EARTH_RADIUS_METERS) * 1.01
+    lat_rings = math.ceil(radius_degrees / lat_step)
+    # Longitude degrees shrink with cos(latitude); size the east-west rings for
+    # the most poleward latitude the circle reaches.
+    cos_edge = math.cos(math.radians(min(abs(latitude) + radius_degrees, 90.0)))
+    if cos_edge <= 1e-9:
+        return None
+    lon_rings = math.ceil(radius_degrees / cos_edge / lon_step)
+    if max_cells is not None and (2 * lat_rings + 1) * (2 * lon_rings + 1) > max_cells:
+        return None
+
+    cells = [center]
+    seen = {center}
+    for d_lat in range(-lat_rings, lat_rings + 1):
+        neighbor_lat = center_lat + d_lat * lat_step
+        if not -90.0 <= neighbor_lat <= 90.0:
+            continue  # No cells beyond the poles
+        for d_lon in range(-lon_rings, lon_rings + 1):
+            # Wrap around the antimeridian
+            neighbor_lon = (center_lon + d_lon * lon_step + 180.0) % 360.0 - 180.0
+            cell = encode_geohash(neighbor_lat, neighbor_lon, precision)
+            if cell not in seen:
+                seen.add(cell)
+                cells.append(cell)
+    return cells
+
+
+def make_proximity_check(
+    latitude: float, longitude: float, radius_meters: float
+) -> Callable[[float, float], bool]:
+    """
+    Returns a predicate telling whether a (latitude, longitude) lies within
+    radius_meters of the given point, using the haversine formula.
+    For radii of a few hundred metres the spherical error is far below 1m,
+    so the iterative ellipsoidal geodesic is not needed.
+    Everything that depends only on the query point is computed once here, and
+    the haversine term is compared against sin^2(r / 2R) directly, which skips
+    the sqrt/arcsin needed to turn it into a distance.
+    Points clearly outside the radius are rejected before any of that: first by
+    a latitude/longitude bounding box (two abs-and-compare checks), then by a
+    flat-earth (equirectangular) squared distance in degrees. Neither needs trig.
+    """
+    q_lat = math.radians(latitude)
+    q_lon = math.radians(longitude)
+    cos_q_lat = math.cos(q_lat)
+    threshold = math.sin(radius_meters / (2 * EARTH_RADIUS_METERS)) ** 2
+
+    # Radius in degrees of arc, with 1% slack so the approximation never
+    # rejects a point the exact check would accept.
+    radius_degrees = math.degrees(radius_meters / EARTH_RADIUS_METERS) * 1.01
+    reject_threshold_sq = radius_degrees * radius_degrees
+    # Half-extents of the bounding box; longitude degrees shrink with cos(latitude)
+    max_d_lat = radius_degrees
+    max_d_lon = radius_degrees / cos_q_lat if cos_q_lat > 1e-9 else 360.0
+
+    def is_within(lat: float, lon: float) -> bool:
+        dy = lat - latitude
+        if abs(dy) > max_d_lat:
+            return False
+        d_lon_deg = lon - longitude
+        if d_lon_deg > 180.0:
+            d_lon_deg -= 360.0
+        elif d_lon_deg < -180.0:
+            d_lon_deg += 360.0
+        if abs(d_lon_deg) > max_d_lon:
+            return False
+
+        dx = d_lon_deg * cos_q_lat
+        if dx * dx + dy * dy > reject_threshold_sq:
+            return False
+
+        s_lat = math.radians(lat)
+        sin_d_lat = math.sin((s_lat - q_lat) / 2)
+        sin_d_lon = math.sin((math.radians(lon) - q_lon) / 2)
+        a = sin_d_lat * sin_d_lat + cos_q_lat * math.cos(s_lat) * sin_d_lon * sin_d_lon
+        return a <= threshold
+
+    return is_within
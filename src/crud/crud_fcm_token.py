@@ -1,17 +1,31 @@
 from firebase_admin import firestore
 from typing import Optional
+from cachetools import TTLCache
 
 from src.models.fcm_token import FCMTokenInDB, FCMToken # Import both
+from src.crud import crud_schedule
 
 FCM_TOKENS_COLLECTION = "fcm_token"  # As used in existing locations.py
 
+# Tokens rarely change, and devices post locations every few seconds,
+# so keep found tokens in-process for 10 minutes instead of re-reading Firestore.
+# The copies on schedule documents use the same maximum age.
+_token_cache: TTLCache = TTLCache(
+    maxsize=10_000, ttl=crud_schedule.CACHED_FCM_TOKEN_MAX_AGE_SECONDS
+)
+
 async def get_fcm_token_by_user_id(
     db: firestore.AsyncClient, firebase_userid: str
 ) -> Optional[FCMTokenInDB]:
     """
     Retrieves an FCM token for a given firebase_userid.
     The firebase_userid is the document ID in the fcm_tokens collection.
+    Results are cached for 10 minutes; missing tokens are not cached.
     """
+    cached = _token_cache.get(firebase_userid)
+    if cached is not None:
+        return cached
+
     doc_ref = db.collection(FCM_TOKENS_COLLECTION).document(firebase_userid)
     doc_snapshot = await doc_ref.get()
 
@@ -24,4 +38,23 @@ async def get_fcm_token_by_user_id(
         return None
     
     # The document ID is the firebase_userid
-    return FCMTokenInDB(user_id=doc_snapshot.id, token=token_data["token"]) 
\ No newline at end of file
+    fcm_token = FCMTokenInDB(user_id=doc_snapshot.id, token=token_data["token"])
+    _token_cache[firebase_userid] = fcm_token
+    return fcm_token
+
+async def refresh_cached_fcm_token(
+    db: firestore.AsyncClient, firebase_userid: str
+) -> Optional[FCMTokenInDB]:
+    """
+    Re-reads the user's token from the fcm_token collection, bypassing the
+    in-process cache, and copies it onto the user's schedules again.
+    If the user no longer has a token (logout, revoked), the copies are removed
+    so later proximity checks stop sending to the dead token.
+    Used when the copies are missing or expired, and when a send with a copy fails.
+    """
+    _token_cache.pop(firebase_userid, None)
+    fcm_token = await get_fcm_token_by_user_id(db, firebase_userid)
+    await crud_schedule.set_cached_fcm_token(
+        db, firebase_userid, fcm_token.token if fcm_token is not None else None
+    )
+    return fcm_token
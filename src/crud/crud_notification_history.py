@@ -1,19 +1,74 @@
 from firebase_admin import firestore
-from typing import Optional
-from datetime import datetime
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta, timezone
+from cachetools import TLRUCache
+import asyncio
+import logging
 
+from src.db.firestore_client import MAX_BATCH_WRITES
 from src.models.notification_history import LastSentTimestamp
 
+logger = logging.getLogger(__name__)
+
 NOTIFICATION_HISTORY_COLLECTION = "notification_history"
 
+# History writes are buffered here (doc_id -> last_sent_at) and committed together
+# in WriteBatches by run_history_flusher, instead of one set() RPC per notification.
+# Repeated writes to the same document before a flush collapse into one.
+_pending_writes: Dict[str, datetime] = {}
+FLUSH_INTERVAL_SECONDS = 0.5
+
+# Minimum time between two proximity notifications for the same user and schedule
+NOTIFICATION_COOLDOWN = timedelta(minutes=10)
+
+
+def _cooldown_remaining_seconds(last_sent_at: datetime) -> float:
+    if last_sent_at.tzinfo is None:
+        last_sent_at = last_sent_at.replace(tzinfo=timezone.utc)
+    return (last_sent_at + NOTIFICATION_COOLDOWN - datetime.now(timezone.utc)).total_seconds()
+
+
+# Write-through cache of last_sent_at keyed by history document ID, holding only
+# cooldowns that are still active and expiring each one when its cooldown ends.
+# An expired timestamp is never served from here: another worker may have sent
+# since, so once the window is over the check has to read Firestore again.
+_last_sent_cache: TLRUCache = TLRUCache(
+    maxsize=10_000,
+    ttu=lambda _key, history, now: now + _cooldown_remaining_seconds(history.last_sent_at),
+)
+
+
+def _cache_last_sent(doc_id: str, history: LastSentTimestamp) -> None:
+    if _cooldown_remaining_seconds(history.last_sent_at) > 0:
+        _last_sent_cache[doc_id] = history
+    else:
+        # TLRUCache skips expired values without replacing an existing entry
+        _last_sent_cache.pop(doc_id, None)
+
+def history_doc_id(user_id: str, schedule_id: str) -> str:
+    """
+    Composite document ID for a user-schedule pair.
+    Callers that read and then write the same pair can build it once and pass it
+    as doc_id to both functions below.
+    """
+    return f"{user_id}_{schedule_id}"
+
 async def get_notification_history(
-    db: firestore.AsyncClient, user_id: str, schedule_id: str
+    db: firestore.AsyncClient,
+    user_id: str,
+    schedule_id: str,
+    doc_id: Optional[str] = None,
 ) -> Optional[LastSentTimestamp]:
     """
     Retrieves the last sent timestamp for a user-schedule pair.
     Document ID is expected to be f'{user_id}_{schedule_id}'.
     """
-    doc_id = f"{user_id}_{schedule_id}"
+    if doc_id is None:
+        doc_id = history_doc_id(user_id, schedule_id)
+    cached = _last_sent_cache.get(doc_id)
+    if cached is not None:
+        return cached
+
     doc_ref = db.collection(NOTIFICATION_HISTORY_COLLECTION).document(doc_id)
     doc_snapshot = await doc_ref.get()
 
@@ -25,17 +80,99 @@ async def get_notification_history(
         return None 
         
     # Firestore timestamps are automatically converted to datetime objects by the client library
-    return LastSentTimestamp(last_sent_at=data["last_sent_at"])
+    history = LastSentTimestamp(last_sent_at=data["last_sent_at"])
+    _cache_last_sent(doc_id, history)
+    return history
+
+async def get_notification_histories(
+    db: firestore.AsyncClient,
+    user_id: str,
+    schedule_ids: List[str],
+) -> Dict[str, Optional[LastSentTimestamp]]:
+    """
+    Batch form of get_notification_history for one user and many schedules.
+    Returns schedule_id -> last sent timestamp (None if never sent).
+    Pairs not in the cache are fetched together in a single get_all call
+    instead of one round trip each.
+    """
+    histories: Dict[str, Optional[LastSentTimestamp]] = {}
+    # doc_id -> schedule_id for the pairs that still have to be read
+    missing: Dict[str, str] = {}
+    for schedule_id in schedule_ids:
+        doc_id = history_doc_id(user_id, schedule_id)
+        histories[schedule_id] = _last_sent_cache.get(doc_id)
+        if histories[schedule_id] is None:
+            missing[doc_id] = schedule_id
+
+    if not missing:
+        return histories
+
+    collection_ref = db.collection(NOTIFICATION_HISTORY_COLLECTION)
+    doc_refs = [collection_ref.document(doc_id) for doc_id in missing]
+    # get_all does not preserve order, so results are matched back by document ID
+    async for doc_snapshot in db.get_all(doc_refs, field_paths=["last_sent_at"]):
+        if not doc_snapshot.exists:
+            continue
+        data = doc_snapshot.to_dict()
+        if not data or "last_sent_at" not in data:
+            continue
+        history = LastSentTimestamp(last_sent_at=data["last_sent_at"])
+        _cache_last_sent(doc_snapshot.id, history)
+        histories[missing[doc_snapshot.id]] = history
+    return histories
 
 async def update_notification_history(
-    db: firestore.AsyncClient, user_id: str, schedule_id: str, timestamp: datetime
+    db: firestore.AsyncClient,
+    user_id: str,
+    schedule_id: str,
+    timestamp: datetime,
+    doc_id: Optional[str] = None,
 ) -> None:
     """
     Updates or creates the last sent timestamp for a user-schedule pair.
     Document ID is f'{user_id}_{schedule_id}'.
+    The Firestore write is buffered and committed by the next flush.
     """
-    doc_id = f"{user_id}_{schedule_id}"
-    doc_ref = db.collection(NOTIFICATION_HISTORY_COLLECTION).document(doc_id)
-    # Using set with merge=True would also work if there were other fields,
-    # but for just one field, set is fine and will create/overwrite.
-    await doc_ref.set({"last_sent_at": timestamp}) 
\ No newline at end of file
+    if doc_id is None:
+        doc_id = history_doc_id(user_id, schedule_id)
+    # Queued for the next batched flush; the cache is updated immediately so the
+    # cooldown applies even before the write reaches Firestore.
+    _pending_writes[doc_id] = timestamp
+    _cache_last_sent(doc_id, LastSentTimestamp(last_sent_at=timestamp))
+
+async def flush_notification_history(db: firestore.AsyncClient) -> None:
+    """
+    Commits all buffered history writes, up to MAX_BATCH_WRITES per WriteBatch.
+    Writes from a failed batch are put back so the next flush retries them.
+    """
+    while _pending_writes:
+        chunk = []
+        for doc_id in list(_pending_writes)[:MAX_BATCH_WRITES]:
+            chunk.append((doc_id, _pending_writes.pop(doc_id)))
+
+        batch = db.batch()
+        collection_ref = db.collection(NOTIFICATION_HISTORY_COLLECTION)
+        for doc_id, timestamp in chunk:
+            # set() creates or overwrites the document, same as before batching
+            batch.set(collection_ref.document(doc_id), {"last_sent_at": timestamp})
+        try:
+            await batch.commit()
+        except BaseException:
+            # Also covers CancelledError when shutdown cancels the flusher mid-commit,
+            # so the final flush still writes these (set() is idempotent if it had landed)
+            for doc_id, timestamp in chunk:
+                # Don't clobber a newer timestamp queued while this batch was in flight
+                _pending_writes.setdefault(doc_id, timestamp)
+            raise
+
+async def run_history_flusher(db: firestore.AsyncClient) -> None:
+    """
+    Background loop that flushes buffered history writes every FLUSH_INTERVAL_SECONDS.
+    Started and cancelled by the application lifespan.
+    """
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+        try:
+            await flush_notification_history(db)
+        except Exception as e:
+            logger.error(f"Failed to flush notification history: {e}", exc_info=True)
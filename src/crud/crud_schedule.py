@@ -1,17 +1,181 @@
 from firebase_admin import firestore
-from google.cloud.firestore_v1 import GeoPoint, FieldFilter
-from typing import List, Optional
-from datetime import datetime # Ensure datetime is imported
+from google.cloud.firestore_v1 import AsyncCollectionReference, GeoPoint, FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+from google.api_core.exceptions import (
+    Aborted,
+    DeadlineExceeded,
+    FailedPrecondition,
+    NotFound,
+)
+from google.api_core.retry import if_exception_type
+from google.api_core.retry_async import AsyncRetry
+import asyncio
+import logging
+from operator import attrgetter
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from cachetools import TTLCache
+from datetime import datetime, timedelta, timezone # Ensure datetime is imported
 
-from src.models.schedule import Schedule # Only Schedule is needed for read operations
+from src.db.firestore_client import MAX_BATCH_WRITES, commit_updates_in_batches
+from src.models.schedule import Schedule, ScheduleCreate, ScheduleUpdate, ProximityCandidate
+from src.core.geo import encode_geohash, geohash_cells_covering
+
+logger = logging.getLogger(__name__)
 
 SCHEDULES_COLLECTION = "schedule"
+MAX_IN_FILTER_VALUES = 30  # Firestore's limit on values in an "in" filter
+# Bulk writes commit at most this many batches at once; throughput gains flatten
+# out around 20-40 concurrent batches, and unbounded fan-out hits DeadlineExceeded.
+MAX_CONCURRENT_BATCH_COMMITS = 20
+# Batches only use set(), so re-committing one after a transient failure is safe
+_BATCH_COMMIT_RETRY = AsyncRetry(
+    predicate=if_exception_type(Aborted, DeadlineExceeded),
+    initial=0.5,
+    multiplier=2.0,
+    maximum=8.0,
+    timeout=60.0,
+)
+
+# Firestore fields needed to build a Schedule; reads project to these so
+# extra stored fields (geohash, cached_fcm_token, ...) are not transferred.
+_SCHEDULE_READ_FIELDS = ["title", "userId", "content", "geoPoint", "datetime"]
+
+# Users whose schedules were recently checked for a missing or stale geohash
+# (see backfill_geohashes). Schedules written straight to Firestore by the app
+# carry no geohash, so each user is re-checked once this TTL expires.
+GEOHASH_RECHECK_SECONDS = 600
+_geohash_checked_users: TTLCache = TTLCache(maxsize=10_000, ttl=GEOHASH_RECHECK_SECONDS)
+# In-flight backfill per user, so concurrent location updates share one scan
+_geohash_backfills: Dict[str, asyncio.Task] = {}
+
+# The FCM token copied onto schedules is only trusted for as long as the
+# in-process token cache (crud_fcm_token) would trust its own entry. The app
+# writes fcm_token/{uid} directly, so a replaced token that still works would
+# otherwise keep receiving the user's notifications indefinitely.
+CACHED_FCM_TOKEN_MAX_AGE_SECONDS = 600
+
+# ScheduleUpdate field name -> Firestore key; avoids a model_dump(by_alias=True) per update
+_UPDATE_FIELD_TO_FIRESTORE = {
+    "name": "title",
+    "latitude": "latitude",
+    "longitude": "longitude",
+    "description": "content",
+    "schedule_datetime": "datetime",
+}
+
+# GeoPoint -> (latitude, longitude) in one C-level call instead of two attribute lookups
+_geopoint_coords = attrgetter("latitude", "longitude")
+_NO_COORDS = (None, None)
+
+
+# CollectionReference per client, keyed by id(client). The client is stored
+# alongside so a recycled id of a discarded client is never matched.
+_collection_cache: Dict[int, Tuple[firestore.AsyncClient, AsyncCollectionReference]] = {}
+
+
+def _get_collection(db: firestore.AsyncClient) -> AsyncCollectionReference:
+    cached = _collection_cache.get(id(db))
+    if cached is not None and cached[0] is db:
+        return cached[1]
+    collection_ref = db.collection(SCHEDULES_COLLECTION)
+    _collection_cache[id(db)] = (db, collection_ref)
+    return collection_ref
+
+
+def _to_firestore_data(schedule_data: ScheduleCreate) -> dict:
+    # Firestore stores the location as a single geoPoint plus its geohash cell,
+    # which lets proximity checks query only the cells around a device.
+    schedule_db_data = schedule_data.model_dump(
+        by_alias=True, exclude={"latitude", "longitude"}
+    )
+    schedule_db_data["geoPoint"] = GeoPoint(
+        schedule_data.latitude, schedule_data.longitude
+    )
+    schedule_db_data["geohash"] = encode_geohash(
+        schedule_data.latitude, schedule_data.longitude
+    )
+    return schedule_db_data
+
+def _hydrate(doc_id: str, schedule_db_data: dict) -> Schedule:
+    """
+    Builds a Schedule from a (projected) Firestore document without validation.
+    """
+    retrieved_geopoint = schedule_db_data.get("geoPoint")
+    latitude, longitude = (
+        _geopoint_coords(retrieved_geopoint)
+        if isinstance(retrieved_geopoint, GeoPoint)
+        else _NO_COORDS
+    )
+
+    # Data comes from our own collection, so skip validation. The stored keys
+    # are the fields' aliases, which is the first key model_construct looks up
+    # per field, so aliased fields skip its validation_alias fallback.
+    return Schedule.model_construct(
+        title=schedule_db_data.get("title"),
+        latitude=latitude,
+        longitude=longitude,
+        userId=schedule_db_data.get("userId"),
+        content=schedule_db_data.get("content"),
+        datetime=schedule_db_data.get("datetime"),
+        id=doc_id,
+    )
+
+async def create_schedule(
+    db: firestore.AsyncClient, schedule_data: ScheduleCreate
+) -> Schedule:
+    doc_ref = _get_collection(db).document()
+    await doc_ref.set(_to_firestore_data(schedule_data))
+
+    # schedule_data was validated on the way in, so don't validate it again
+    return Schedule.model_construct(id=doc_ref.id, **schedule_data.model_dump())
+
+async def create_schedules_bulk(
+    db: firestore.AsyncClient, items: List[ScheduleCreate]
+) -> List[Schedule]:
+    """
+    Creates many schedules with WriteBatches of up to MAX_BATCH_WRITES
+    documents, committed concurrently, instead of one RPC per schedule.
+    At most MAX_CONCURRENT_BATCH_COMMITS commits are in flight, and each is
+    retried with exponential backoff on Aborted/DeadlineExceeded.
+    Only each batch is atomic: when one fails, the others may still have
+    committed.
+    """
+    collection_ref = _get_collection(db)
+    # Document IDs are generated client-side, so they are known before any commit
+    doc_refs = [collection_ref.document() for _ in items]
+
+    commit_slots = asyncio.Semaphore(MAX_CONCURRENT_BATCH_COMMITS)
+
+    async def commit_chunk(start: int) -> None:
+        batch = db.batch()
+        for doc_ref, schedule_data in zip(
+            doc_refs[start:start + MAX_BATCH_WRITES],
+            items[start:start + MAX_BATCH_WRITES],
+        ):
+            batch.set(doc_ref, _to_firestore_data(schedule_data))
+        async with commit_slots:
+            await batch.commit(retry=_BATCH_COMMIT_RETRY)
+
+    # Let every commit settle before raising, so none is still running unobserved
+    # after the caller has already reported the failure
+    results = await asyncio.gather(
+        *(commit_chunk(start) for start in range(0, len(items), MAX_BATCH_WRITES)),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+    return [
+        Schedule.model_construct(id=doc_ref.id, **schedule_data.model_dump())
+        for doc_ref, schedule_data in zip(doc_refs, items)
+    ]
 
 async def get_schedule(
     db: firestore.AsyncClient, schedule_id: str
 ) -> Optional[Schedule]:
-    doc_ref = db.collection(SCHEDULES_COLLECTION).document(schedule_id)
-    doc_snapshot = await doc_ref.get()
+    doc_ref = _get_collection(db).document(schedule_id)
+    doc_snapshot = await doc_ref.get(field_paths=_SCHEDULE_READ_FIELDS)
 
     if not doc_snapshot.exists:
         return None
@@ -19,25 +183,202 @@ async def get_schedule(
     schedule_db_data = doc_snapshot.to_dict()
     if not schedule_db_data: return None
 
-    schedule_db_data["id"] = doc_snapshot.id
+    return _hydrate(doc_snapshot.id, schedule_db_data)
 
-    retrieved_geopoint = schedule_db_data.pop("geoPoint", None)
-    if isinstance(retrieved_geopoint, GeoPoint):
-        schedule_db_data["latitude"] = retrieved_geopoint.latitude
-        schedule_db_data["longitude"] = retrieved_geopoint.longitude
-    else:
-        schedule_db_data["latitude"] = None
-        schedule_db_data["longitude"] = None
-    
-    return Schedule(**schedule_db_data)
+async def update_schedule(
+    db: firestore.AsyncClient, schedule_id: str, schedule_data: ScheduleUpdate
+) -> Optional[Schedule]:
+    """
+    Applies the fields set on schedule_data and returns the updated schedule,
+    or None if it does not exist. The document is only read before the update
+    when exactly one of latitude/longitude changes and the other half of the
+    geoPoint has to come from the stored document; that read and the update
+    run in a transaction.
+    """
+    doc_ref = _get_collection(db).document(schedule_id)
+    # Only the fields the client actually sent, renamed to their Firestore keys
+    update_data = {
+        _UPDATE_FIELD_TO_FIRESTORE[field_name]: getattr(schedule_data, field_name)
+        for field_name in schedule_data.model_fields_set
+    }
+    latitude = update_data.pop("latitude", None)
+    longitude = update_data.pop("longitude", None)
 
-async def get_schedules_by_user(
-    db: firestore.AsyncClient, firebase_userid: str
-) -> List[Schedule]:
-    schedules_list = []
-    query = db.collection(SCHEDULES_COLLECTION).where(
+    if (latitude is None) != (longitude is None):
+        # Read the stored geoPoint and write the merged one in one transaction,
+        # so a concurrent coordinate change can't slip in between the two.
+        @firestore.async_transactional
+        async def merge_geopoint_and_update(transaction) -> Optional[dict]:
+            doc_snapshot = await doc_ref.get(
+                field_paths=_SCHEDULE_READ_FIELDS, transaction=transaction
+            )
+            if not doc_snapshot.exists:
+                return None
+            existing_data = doc_snapshot.to_dict() or {}
+            existing_geopoint = existing_data.get("geoPoint")
+            if not isinstance(existing_geopoint, GeoPoint):
+                # Nothing to merge the single coordinate with
+                return None
+            merged_latitude = latitude if latitude is not None else existing_geopoint.latitude
+            merged_longitude = longitude if longitude is not None else existing_geopoint.longitude
+            changes = {
+                **update_data,
+                "geoPoint": GeoPoint(merged_latitude, merged_longitude),
+                "geohash": encode_geohash(merged_latitude, merged_longitude),
+            }
+            transaction.update(doc_ref, changes)
+            # The stored fields with this update applied, i.e. the document as committed
+            return existing_data | changes
+
+        # The transaction is retried on contention (Aborted), up to max_attempts
+        updated_data = await merge_geopoint_and_update(db.transaction(max_attempts=3))
+        if updated_data is None:
+            return None
+        # Every field is known from the transactional read plus the update, so the
+        # response is built locally instead of re-reading the document
+        return _hydrate(schedule_id, updated_data)
+
+    if latitude is not None and longitude is not None:
+        update_data["geoPoint"] = GeoPoint(latitude, longitude)
+        update_data["geohash"] = encode_geohash(latitude, longitude)
+
+    if update_data:
+        try:
+            # update() fails with NotFound on a missing document, so no existence pre-read is needed
+            await doc_ref.update(update_data)
+        except NotFound:
+            return None
+
+    return await get_schedule(db, schedule_id)
+
+async def delete_schedule(db: firestore.AsyncClient, schedule_id: str) -> bool:
+    """
+    Deletes a schedule. Returns False if it did not exist.
+    The exists precondition makes Firestore report a missing document,
+    so no separate existence read is needed.
+    """
+    doc_ref = _get_collection(db).document(schedule_id)
+    try:
+        await doc_ref.delete(option=db.write_option(exists=True))
+    except (NotFound, FailedPrecondition):
+        return False
+    return True
+
+async def iter_schedules_by_user(
+    db: firestore.AsyncClient,
+    firebase_userid: str,
+    *,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> AsyncIterator[Schedule]:
+    """
+    Yields the user's schedules one at a time as they arrive from Firestore.
+    Closing the generator early (e.g. after a break) cancels the remaining reads.
+    Results are ordered by schedule datetime; `cursor` is the ID of the last
+    schedule already seen and `limit` caps how many are returned.
+    """
+    collection_ref = _get_collection(db)
+    query = collection_ref.where(
+        filter=FieldFilter("userId", "==", firebase_userid)
+    ).order_by("datetime").select(_SCHEDULE_READ_FIELDS)
+    if cursor is not None:
+        # A snapshot cursor carries both the datetime and the document ID,
+        # so schedules sharing a datetime are neither skipped nor repeated.
+        cursor_snapshot = await collection_ref.document(cursor).get(
+            field_paths=["datetime"]  # Only the order_by field is needed for the cursor
+        )
+        if not cursor_snapshot.exists:
+            return
+        query = query.start_after(cursor_snapshot)
+    if limit is not None:
+        query = query.limit(limit)
+    docs_stream = query.stream()
+
+    async for doc_snapshot in docs_stream:
+        if doc_snapshot.exists:
+            schedule_db_data = doc_snapshot.to_dict()
+            if not schedule_db_data: continue
+
+            yield _hydrate(doc_snapshot.id, schedule_db_data)
+
+def _fresh_cached_fcm_token(schedule_db_data: dict, cutoff: datetime) -> Optional[str]:
+    cached_at = schedule_db_data.get("cached_fcm_token_at")
+    if not isinstance(cached_at, datetime):
+        return None  # Copies from before the timestamp existed are treated as stale
+    if cached_at.tzinfo is None:
+        cached_at = cached_at.replace(tzinfo=timezone.utc)
+    return schedule_db_data.get("cached_fcm_token") if cached_at >= cutoff else None
+
+async def backfill_geohashes(db: firestore.AsyncClient, firebase_userid: str) -> int:
+    """
+    Writes the geohash of every schedule of the user whose geohash is missing
+    or does not match its geoPoint (documents created before the field existed,
+    or written directly by the app). Returns the number of documents updated.
+    """
+    query = _get_collection(db).where(
+        filter=FieldFilter("userId", "==", firebase_userid)
+    ).select(["geoPoint", "geohash"])
+
+    async def geohash_updates():
+        async for doc_snapshot in query.stream():
+            schedule_db_data = doc_snapshot.to_dict() or {}
+            retrieved_geopoint = schedule_db_data.get("geoPoint")
+            if not isinstance(retrieved_geopoint, GeoPoint):
+                continue
+            geohash = encode_geohash(retrieved_geopoint.latitude, retrieved_geopoint.longitude)
+            if schedule_db_data.get("geohash") != geohash:
+                yield doc_snapshot.reference, {"geohash": geohash}
+
+    return await commit_updates_in_batches(db, geohash_updates())
+
+async def _backfill_geohashes_once(db: firestore.AsyncClient, firebase_userid: str) -> None:
+    try:
+        updated = await backfill_geohashes(db, firebase_userid)
+        _geohash_checked_users[firebase_userid] = True
+        if updated:
+            logger.info(f"Backfilled geohash on {updated} schedules of user {firebase_userid}")
+    finally:
+        _geohash_backfills.pop(firebase_userid, None)
+
+async def _ensure_geohashes(db: firestore.AsyncClient, firebase_userid: str) -> None:
+    """
+    Makes sure the user's schedules were backfilled within GEOHASH_RECHECK_SECONDS.
+    Concurrent callers for the same user wait on one shared backfill.
+    """
+    if firebase_userid in _geohash_checked_users:
+        return
+    backfill = _geohash_backfills.get(firebase_userid)
+    if backfill is None:
+        backfill = asyncio.create_task(_backfill_geohashes_once(db, firebase_userid))
+        _geohash_backfills[firebase_userid] = backfill
+    # shield: a cancelled request must not cancel the backfill other requests wait on
+    await asyncio.shield(backfill)
+
+async def iter_schedules_near(
+    db: firestore.AsyncClient,
+    firebase_userid: str,
+    latitude: float,
+    longitude: float,
+    radius_meters: float,
+) -> AsyncIterator[ProximityCandidate]:
+    """
+    Yields the user's schedules in the geohash cells covering radius_meters around
+    the point (or all of them where that needs too many cells), as they stream in.
+    Callers still need an exact distance check.
+    """
+    await _ensure_geohashes(db, firebase_userid)
+
+    query = _get_collection(db).where(
         filter=FieldFilter("userId", "==", firebase_userid)
     )
+    cells = geohash_cells_covering(
+        latitude, longitude, radius_meters, max_cells=MAX_IN_FILTER_VALUES
+    )
+    if cells is not None:
+        query = query.where(filter=FieldFilter("geohash", "in", cells))
+    query = query.select(["title", "geoPoint", "cached_fcm_token", "cached_fcm_token_at"])
+    # Copies written before this cutoff are ignored; the caller falls back to fcm_token
+    token_cutoff = datetime.now(timezone.utc) - timedelta(seconds=CACHED_FCM_TOKEN_MAX_AGE_SECONDS)
     docs_stream = query.stream()
 
     async for doc_snapshot in docs_stream:
@@ -45,14 +386,51 @@ async def get_schedules_by_user(
             schedule_db_data = doc_snapshot.to_dict()
             if not schedule_db_data: continue
 
-            schedule_db_data["id"] = doc_snapshot.id
-            retrieved_geopoint = schedule_db_data.pop("geoPoint", None)
-            if isinstance(retrieved_geopoint, GeoPoint):
-                schedule_db_data["latitude"] = retrieved_geopoint.latitude
-                schedule_db_data["longitude"] = retrieved_geopoint.longitude
-            else:
-                schedule_db_data["latitude"] = None
-                schedule_db_data["longitude"] = None
-
-            schedules_list.append(Schedule(**schedule_db_data))
-    return schedules_list
+            retrieved_geopoint = schedule_db_data.get("geoPoint")
+            latitude_value, longitude_value = (
+                _geopoint_coords(retrieved_geopoint)
+                if isinstance(retrieved_geopoint, GeoPoint)
+                else _NO_COORDS
+            )
+
+            yield ProximityCandidate(
+                id=doc_snapshot.id,
+                name=schedule_db_data.get("title"),
+                latitude=latitude_value,
+                longitude=longitude_value,
+                cached_fcm_token=_fresh_cached_fcm_token(schedule_db_data, token_cutoff),
+            )
+
+async def set_cached_fcm_token(
+    db: firestore.AsyncClient, firebase_userid: str, token: Optional[str]
+) -> None:
+    """
+    Copies the user's FCM token onto all of their schedule documents
+    (field cached_fcm_token), so the proximity check can notify without
+    reading the fcm_token collection. The copy is eventually consistent.
+    Each copy is stamped with cached_fcm_token_at and ignored once older than
+    CACHED_FCM_TOKEN_MAX_AGE_SECONDS. A token of None removes the copies
+    (the user no longer has a token).
+    """
+    if token is not None:
+        cached_fields = {
+            "cached_fcm_token": token,
+            "cached_fcm_token_at": datetime.now(timezone.utc),
+        }
+    else:
+        cached_fields = {
+            "cached_fcm_token": firestore.DELETE_FIELD,
+            "cached_fcm_token_at": firestore.DELETE_FIELD,
+        }
+    collection_ref = _get_collection(db)
+    # Only the document references are needed. Project to the document ID
+    # explicitly: an empty projection means "all fields" in the Firestore API.
+    query = collection_ref.where(
+        filter=FieldFilter("userId", "==", firebase_userid)
+    ).select([FieldPath.document_id()])
+
+    async def token_updates():
+        async for doc_snapshot in query.stream():
+            yield doc_snapshot.reference, cached_fields
+
+    await commit_updates_in_batches(db, token_updates())
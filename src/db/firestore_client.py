@@ -0,0 +1,64 @@
+from firebase_admin import firestore
+from google.cloud.firestore_v1 import AsyncDocumentReference
+from typing import AsyncIterator, Optional, Tuple
+
+MAX_BATCH_WRITES = 500  # Firestore's per-batch write limit
+
+# Single shared Async Firestore client for the whole process.
+# Constructing a client parses credentials and opens a new gRPC channel,
+# so it is created once (lazily, or by the app lifespan) and reused by every request.
+_db: Optional[firestore.AsyncClient] = None
+
+
+def get_db_client() -> firestore.AsyncClient:
+    # Note: Firebase Admin SDK must be initialized (e.g., in main.py lifespan)
+    # for firestore.AsyncClient() to work correctly with ADC or provided credentials.
+    global _db
+    if _db is None:
+        _db = firestore.AsyncClient()
+    return _db
+
+
+async def close_db_client() -> None:
+    """
+    Closes the shared client's gRPC channel. Called on application shutdown.
+    """
+    global _db
+    if _db is None:
+        return
+    client, _db = _db, None
+    # AsyncClient has no public close(); the underlying GAPIC transport owns the channel.
+    await client._firestore_api.transport.close()
+
+
+async def prewarm_db_client(db: firestore.AsyncClient) -> None:
+    """
+    Issues one throwaway read so the gRPC channel's TLS handshake and the
+    OAuth token fetch happen at startup instead of on the first real request.
+    """
+    # Reading a missing document still does a full round trip but returns no data
+    await db.collection("_warmup").document("_warmup").get()
+
+
+async def commit_updates_in_batches(
+    db: firestore.AsyncClient,
+    updates: AsyncIterator[Tuple[AsyncDocumentReference, dict]],
+) -> int:
+    """
+    Applies (document, fields) updates as they arrive, committing a WriteBatch
+    every MAX_BATCH_WRITES updates. Returns the number of documents updated.
+    """
+    batch = db.batch()
+    pending = 0
+    updated = 0
+    async for doc_ref, fields in updates:
+        batch.update(doc_ref, fields)
+        pending += 1
+        updated += 1
+        if pending == MAX_BATCH_WRITES:
+            await batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        await batch.commit()
+    return updated
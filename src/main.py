@@ -1,5 +1,7 @@
 from fastapi import FastAPI
-from contextlib import asynccontextmanager
+from fastapi.responses import ORJSONResponse
+from contextlib import asynccontextmanager, suppress
+import asyncio
 import firebase_admin
 from firebase_admin import credentials
 import logging  # Add logging import
@@ -7,7 +9,10 @@ import os  # Import os module
 
 from src.api.v1.endpoints import locations
 from src.api.v1.endpoints import schedules  # Import the new schedules router
-from src.core.config import settings  # Import the settings instance
+from src.core.config import get_settings  # Lazily built settings
+from src.db.firestore_client import get_db_client, close_db_client, prewarm_db_client
+from src.crud import crud_notification_history
+from src.services.notification_service import close_http_client
 
 # Configure basic logging
 # In a more complex app, you might move this to a dedicated logging_config.py
@@ -18,10 +23,19 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)  # Create a logger for this module
 
 
+async def _prewarm_db(db) -> None:
+    try:
+        await prewarm_db_client(db)
+        logger.info("Firestore client prewarmed.")
+    except Exception as e:
+        # Only an optimisation; the first real request will retry the connection
+        logger.warning(f"Firestore prewarm read failed: {e}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Initialize Firebase Admin SDK using Pydantic Settings
-    cred_path = settings.GOOGLE_APPLICATION_CREDENTIALS
+    cred_path = get_settings().GOOGLE_APPLICATION_CREDENTIALS
     if not cred_path:
         logger.error(
             "GOOGLE_APPLICATION_CREDENTIALS not found in settings or .env file."
@@ -34,11 +48,22 @@ async def lifespan(app: FastAPI):
                 f"Set GOOGLE_APPLICATION_CREDENTIALS environment variable to: {cred_path}"
             )
 
-            cred = credentials.Certificate(cred_path)
+            # Reading and parsing the service-account key is blocking file I/O + RSA work
+            cred = await asyncio.to_thread(credentials.Certificate, cred_path)
             firebase_admin.initialize_app(cred)
             logger.info(
                 "Firebase Admin SDK initialized successfully using credentials from settings."
             )
+
+            # Create the shared Firestore client (and its gRPC channel) once at startup
+            app.state.db = get_db_client()
+            # Open the channel and fetch an auth token in the background so
+            # the first request does not pay for it; startup does not wait on it.
+            app.state.db_prewarm = asyncio.create_task(_prewarm_db(app.state.db))
+            # Periodically commit buffered notification-history writes in batches
+            app.state.history_flusher = asyncio.create_task(
+                crud_notification_history.run_history_flusher(app.state.db)
+            )
         except FileNotFoundError:
             logger.error(
                 f"Firebase credentials file not found at path: {cred_path}. Check your .env file and path."
@@ -47,7 +72,27 @@ async def lifespan(app: FastAPI):
             logger.error(f"Failed to initialize Firebase Admin SDK: {e}", exc_info=True)
 
     yield
-    # Add shutdown code here if needed in the future
+    # Cancel the prewarm read if startup-to-shutdown was quicker than it
+    db_prewarm = getattr(app.state, "db_prewarm", None)
+    if db_prewarm is not None:
+        db_prewarm.cancel()
+        with suppress(asyncio.CancelledError):
+            await db_prewarm
+
+    # Stop the history flusher and commit whatever is still buffered
+    history_flusher = getattr(app.state, "history_flusher", None)
+    if history_flusher is not None:
+        history_flusher.cancel()
+        with suppress(asyncio.CancelledError):
+            await history_flusher
+        try:
+            await crud_notification_history.flush_notification_history(app.state.db)
+        except Exception as e:
+            logger.error(f"Failed to flush notification history on shutdown: {e}", exc_info=True)
+
+    # Close the shared Firestore client's gRPC channel and the FCM HTTP client
+    await close_db_client()
+    await close_http_client()
     # For Firebase, cleanup is usually handled automatically, but you could add firebase_admin.delete_app(firebase_admin.get_app()) if needed.
 
 
@@ -56,6 +101,8 @@ app = FastAPI(
     description="API for Itzy Mayo services, starting with location tracking.",
     version="0.1.0",
     lifespan=lifespan,
+    # orjson encodes responses (e.g. long schedule lists) much faster than stdlib json
+    default_response_class=ORJSONResponse,
 )
 
 # Include the API routers
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
 from typing import Optional
 from datetime import datetime # Import datetime
+from dataclasses import dataclass
 
 # For GeoPoint, we'll handle it in the CRUD layer.
 # API models will use latitude and longitude.
@@ -64,3 +65,16 @@ class ScheduleInDBBase(ScheduleBase):
 # This is the main model that will be returned by API endpoints reading schedule data
 class Schedule(ScheduleInDBBase):
     pass
+
+
+# Slim, unvalidated view of a schedule used only by the proximity check.
+# Built from a projected Firestore query, so it skips Pydantic validation entirely.
+@dataclass(slots=True)
+class ProximityCandidate:
+    id: str
+    name: Optional[str]
+    latitude: Optional[float]
+    longitude: Optional[float]
+    # Copy of the owner's FCM token denormalized onto the schedule document;
+    # None when there is no copy or it is older than CACHED_FCM_TOKEN_MAX_AGE_SECONDS
+    cached_fcm_token: Optional[str] = None
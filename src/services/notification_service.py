@@ -1,28 +1,140 @@
 import asyncio
 import logging
+from typing import List, Optional
 
-from firebase_admin import messaging
-from firebase_admin.exceptions import FirebaseError
+import firebase_admin
+import httpx
+from firebase_admin.exceptions import FirebaseError, UNKNOWN
+from google.auth.transport.requests import Request as GoogleAuthRequest
 
 logger = logging.getLogger(__name__)
 
+FCM_SEND_URL = "https://fcm.googleapis.com/v1/projects/{project_id}/messages:send"
+FCM_REQUEST_TIMEOUT_SECONDS = 10.0
+# Bulk sends keep at most this many requests in flight at once
+MAX_FCM_MESSAGES_PER_BATCH = 500
+# Retries matching firebase_admin's DEFAULT_RETRY_CONFIG that messaging.send used:
+# up to 4 retries on HTTP 500/503 and up to 2 on connection/read errors,
+# with exponential backoff starting at 0.5s.
+FCM_RETRY_STATUSES = frozenset({500, 503})
+FCM_MAX_STATUS_RETRIES = 4
+FCM_MAX_TRANSPORT_RETRIES = 2
+FCM_RETRY_BACKOFF_SECONDS = 0.5
+# Same API format header messaging.send sends, so error bodies have the same shape
+_FCM_HEADERS = {"X-GOOG-API-FORMAT-VERSION": "2"}
 
-async def send_fcm_proximity_notification(token: str, user_id: str) -> bool:
-    message = messaging.Message(
-        notification=messaging.Notification(
-            title="일정 알림",  # "Schedule Notification"
-            body="주변에 설정된 일정이 있습니다!",  # "There is a schedule nearby!"
-        ),
-        token=token,
-        # You can also send data payload if needed
-        # data={
-        #     "userId": user_id,
-        #     "type": "proximity_alert"
-        # }
+# The notification content never changes, so it is built once and shared by every message.
+# This is the FCM v1 JSON messaging.send would encode from a messaging.Notification.
+_PROXIMITY_NOTIFICATION = {
+    "title": "일정 알림",  # "Schedule Notification"
+    "body": "주변에 설정된 일정이 있습니다!",  # "There is a schedule nearby!"
+}
+
+# messaging.send is blocking (requests), so every send used to take a thread from the
+# default pool. Sends now go straight to the FCM v1 endpoint over one shared HTTP/2
+# connection, which multiplexes concurrent requests without any thread hop.
+_http_client: Optional[httpx.AsyncClient] = None
+_fcm_url: Optional[str] = None
+_token_refresh_lock = asyncio.Lock()
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            http2=True, timeout=FCM_REQUEST_TIMEOUT_SECONDS
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """
+    Closes the shared FCM HTTP client. Called on application shutdown.
+    """
+    global _http_client
+    if _http_client is None:
+        return
+    client, _http_client = _http_client, None
+    await client.aclose()
+
+
+def _get_fcm_url() -> str:
+    global _fcm_url
+    if _fcm_url is None:
+        project_id = firebase_admin.get_app().project_id
+        if not project_id:
+            raise ValueError("Project ID is required to send FCM messages.")
+        _fcm_url = FCM_SEND_URL.format(project_id=project_id)
+    return _fcm_url
+
+
+async def _get_access_token() -> str:
+    # The same service-account credential firebase_admin.messaging authenticates with
+    credential = firebase_admin.get_app().credential.get_credential()
+    if not credential.valid:
+        async with _token_refresh_lock:
+            # Another request may have refreshed it while this one waited
+            if not credential.valid:
+                # Refreshing is a blocking HTTP call, but only happens about once an hour
+                # (google-auth treats the token as expired a few minutes early)
+                await asyncio.to_thread(credential.refresh, GoogleAuthRequest())
+    return credential.token
+
+
+def _fcm_error(response: httpx.Response) -> FirebaseError:
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+    error = body.get("error") if isinstance(body, dict) else None
+    if not isinstance(error, dict):
+        error = {}
+    message = error.get("message") or (
+        f"Unexpected HTTP response with status: {response.status_code}; body: {response.text}"
     )
+    return FirebaseError(error.get("status") or UNKNOWN, message, http_response=response)
+
+
+async def _send_proximity_message(token: str) -> str:
+    """
+    Sends one proximity notification through the FCM v1 API and returns the
+    message name. Transient failures are retried with backoff; raises
+    FirebaseError when FCM rejects the message.
+    """
+    body = {"message": {"token": token, "notification": _PROXIMITY_NOTIFICATION}}
+    status_retries = 0
+    transport_retries = 0
+    while True:
+        access_token = await _get_access_token()
+        try:
+            response = await _get_http_client().post(
+                _get_fcm_url(),
+                headers={**_FCM_HEADERS, "Authorization": f"Bearer {access_token}"},
+                json=body,
+            )
+        except httpx.TransportError:
+            if transport_retries == FCM_MAX_TRANSPORT_RETRIES:
+                raise
+            transport_retries += 1
+        else:
+            if (
+                response.status_code not in FCM_RETRY_STATUSES
+                or status_retries == FCM_MAX_STATUS_RETRIES
+            ):
+                break
+            status_retries += 1
+        await asyncio.sleep(
+            FCM_RETRY_BACKOFF_SECONDS * 2 ** (status_retries + transport_retries - 1)
+        )
+
+    if response.is_error:
+        raise _fcm_error(response)
+    return response.json()["name"]
+
+
+async def send_fcm_proximity_notification(token: str, user_id: str) -> bool:
     try:
-        # messaging.send is a blocking call, so run it in a separate thread
-        response = await asyncio.to_thread(messaging.send, message)
+        response = await _send_proximity_message(token)
         logger.info(f"Successfully sent FCM message to {user_id}: {response}")
         return True
     except FirebaseError as e:
@@ -34,3 +146,29 @@ async def send_fcm_proximity_notification(token: str, user_id: str) -> bool:
             f"Unexpected error sending FCM message to {user_id}: {e}", exc_info=True
         )
     return False
+
+
+async def send_fcm_proximity_notifications_bulk(tokens: List[str]) -> List[bool]:
+    """
+    Sends the proximity notification to many devices, up to 500 requests at a
+    time over the shared connection. Returns one success flag per token, in order.
+    """
+    results: List[bool] = []
+    for start in range(0, len(tokens), MAX_FCM_MESSAGES_PER_BATCH):
+        chunk = tokens[start : start + MAX_FCM_MESSAGES_PER_BATCH]
+        responses = await asyncio.gather(
+            *(_send_proximity_message(token) for token in chunk),
+            return_exceptions=True,
+        )
+
+        success_count = 0
+        for index, response in enumerate(responses, start):
+            if isinstance(response, BaseException):
+                # Logged by position in `tokens`; registration tokens are not logged
+                logger.warning(f"Failed to send FCM message #{index}: {response}")
+                results.append(False)
+            else:
+                success_count += 1
+                results.append(True)
+        logger.info(f"Sent FCM batch: {success_count}/{len(chunk)} succeeded")
+    return results